@@ -3,14 +3,24 @@ Telegram Bot Creator SDK
 Automatically creates Telegram bots via BotFather
 """
 import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import json
 import logging
 import os
 import re
-import secrets
-import string
-from typing import Dict, Optional
+import sys
+import time
+import warnings
+from typing import BinaryIO, Dict, Optional, Union
 from dotenv import load_dotenv
+from aiolimiter import AsyncLimiter
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
@@ -18,33 +28,196 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
 try:
-    from telethon import TelegramClient
-    from telethon.errors import SessionPasswordNeededError
+    from aiogram.fsm.storage.redis import RedisStorage
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    from telethon import TelegramClient, events
+    from telethon.errors import BotResponseTimeoutError, FloodWaitError, RPCError
     from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
+    from telethon.tl.types import MessageEntityCode
     TELETHON_AVAILABLE = True
 except ImportError:
     TELETHON_AVAILABLE = False
 
 load_dotenv()
 
+LOG_LEVEL = (os.getenv('LOG_LEVEL') or 'WARNING').upper()
+_log_level = logging.getLevelName(LOG_LEVEL)  # int for known level names, a 'Level ...' string otherwise
 logging.basicConfig(
-    level=logging.INFO,
+    level=_log_level if isinstance(_log_level, int) else logging.WARNING,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+# Per-update and per-RPC INFO records from the libraries would drown out the bot's own logs
+for _library_logger in ('aiogram.event', 'telethon'):
+    logging.getLogger(_library_logger).setLevel(max(logging.WARNING, logging.getLogger().level))
 logger = logging.getLogger(__name__)
+if not isinstance(_log_level, int):
+    logger.warning("LOG_LEVEL=%s is not a known level name, using WARNING", LOG_LEVEL)
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 BOT_DESCRIPTION = os.getenv('BOT_DESCRIPTION', 'Want the same gift? Check out @FameGifterBot\n\nBot created for entertainment purposes.')
 USERNAME_PREFIX = os.getenv('USERNAME_PREFIX', 'famegifter')
-MESSAGE_DELAY = float(os.getenv('MESSAGE_DELAY', '3.0'))  # Delay between messages to BotFather in seconds
+RESPONSE_TIMEOUT = float(os.getenv('RESPONSE_TIMEOUT', '10.0'))  # Max wait for a BotFather reply in seconds
+BOTFATHER_RATE_LIMIT = int(os.getenv('BOTFATHER_RATE_LIMIT', '20'))  # Max messages to BotFather per minute
+SESSION_NAME = 'sessions/bot_creator'
+FLOOD_SLEEP_THRESHOLD = 60  # Telethon sleeps out shorter FloodWaits itself and raises on longer ones
+REDIS_URL = os.getenv('REDIS_URL')
+STATE_TTL = int(os.getenv('STATE_TTL', '1800'))  # FSM state lifetime in seconds (Redis storage only)
+MAX_CONCURRENT_CREATES = int(os.getenv('MAX_CONCURRENT_CREATES', '1'))  # /create flows admitted at once; BotFather calls are serialized by the session lock anyway
+CREATE_CACHE_TTL = 600  # Seconds a created bot is reused when /create is repeated with the same name
+BOT_API_POOL_LIMIT = 200  # Max open connections to api.telegram.org
+BOT_API_KEEPALIVE = 75  # Seconds an idle Bot API connection is kept for reuse (aiohttp default: 15)
+
+try:
+    API_ID = int(os.getenv('TELEGRAM_API_ID', ''))
+except ValueError:
+    if os.getenv('TELEGRAM_API_ID'):
+        logger.warning("TELEGRAM_API_ID must be a number, bot creation is disabled")
+    API_ID = None
+API_HASH = os.getenv('TELEGRAM_API_HASH') or None
+TELETHON_CONFIGURED = API_ID is not None and API_HASH is not None
+
+_USERNAME_RE = re.compile(r'^[a-z0-9_]+$')
+_TOKEN_RE = re.compile(r'(\d+:[A-Za-z0-9_-]{20,})')
+_CREATE_ERROR_RE = re.compile(r'sorry|error|already|taken|invalid|not available', re.IGNORECASE)
+_TAKEN_RE = re.compile(r'already|taken', re.IGNORECASE)
+_DESCRIPTION_SUCCESS_RE = re.compile(r'success|успешно|description', re.IGNORECASE)
+_AVATAR_SUCCESS_RE = re.compile(r'success|успешно|picture', re.IGNORECASE)
+
+# Configuration does not change at runtime, so /start and /help replies are built once
+if not TELETHON_AVAILABLE:
+    _SETUP_INFO = "\n\nSetup: pip install telethon"
+elif not TELETHON_CONFIGURED:
+    _SETUP_INFO = "\n\nConfiguration required:\n1. Get API_ID and API_HASH from https://my.telegram.org/apps\n2. Add them to .env file\n3. Run: python setup_telethon.py"
+else:
+    _SETUP_INFO = ""
+
+_START_TEXT = (
+    f"Bot Creator SDK\n\n"
+    f"Status: {'Ready' if TELETHON_AVAILABLE and TELETHON_CONFIGURED else 'Not configured'}\n\n"
+    f"Commands:\n"
+    f"/create - Create a new bot\n"
+    f"/help - Show help"
+)
+_HELP_TEXT = (
+    f"Bot Creator SDK Help\n\n"
+    f"Usage:\n"
+    f"1. Use /create command\n"
+    f"2. Enter bot name\n"
+    f"3. Enter bot username (or /auto to generate)\n"
+    f"4. Send avatar photo (optional, use /skip to skip)\n\n"
+    f"The bot will:\n"
+    f"- Create bot via BotFather\n"
+    f"- Set description\n"
+    f"- Return token{_SETUP_INFO}"
+)
+
+_botfather_limiter = AsyncLimiter(BOTFATHER_RATE_LIMIT, 60)
+_bot_api_limiter = AsyncLimiter(30, 1)  # Telegram's global Bot API limit
+_create_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+_create_queue = 0  # Users currently waiting for a /create slot
+
+
+class BotApiRateLimitMiddleware(BaseRequestMiddleware):
+    """Keep outgoing Bot API calls under the global limit and retry once on 429"""
+    
+    async def __call__(self, make_request, bot, method):
+        async with _bot_api_limiter:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retry_after = e.retry_after
+        
+        logger.warning("stage=bot_api method=%s retry_after=%ss", type(method).__name__, retry_after)
+        await asyncio.sleep(retry_after)
+        async with _bot_api_limiter:
+            return await make_request(bot, method)
+
+
+class KeepAliveAiohttpSession(AiohttpSession):
+    """AiohttpSession that keeps idle Bot API connections open longer"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(limit=BOT_API_POOL_LIMIT, **kwargs)
+        self._connector_init['keepalive_timeout'] = BOT_API_KEEPALIVE
 
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN not found in environment variables")
 
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+if REDIS_URL and REDIS_AVAILABLE:
+    storage = RedisStorage.from_url(REDIS_URL, state_ttl=STATE_TTL, data_ttl=STATE_TTL)
+else:
+    if REDIS_URL:
+        logger.warning("REDIS_URL is set but redis is not installed, falling back to in-memory FSM storage")
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+_created_bots: Dict[str, tuple] = {}  # Without Redis: cache key -> (expires_at, {token, username})
+
+
+def _rand_suffix(length: int = 8) -> str:
+    """Random lowercase [a-z2-7] suffix for generated usernames"""
+    raw = os.urandom((length * 5 + 7) // 8)
+    return base64.b32encode(raw).decode('ascii').lower()[:length]
+
+
+async def _create_bot_cached(user_id: int, bot_name: str, username: str, auto: bool) -> Dict:
+    """
+    Create bot, reusing the one this user created under the same name
+    within CREATE_CACHE_TTL
+    
+    An explicitly chosen username must match the cached bot's, an auto-generated
+    one accepts any. Reused results carry 'reused': True. They are kept in Redis
+    when FSM state is, otherwise in process memory.
+    """
+    cache_key = 'created_bot:' + hashlib.blake2b(f"{user_id}:{bot_name}".encode(), digest_size=16).hexdigest()
+    redis = getattr(storage, 'redis', None)
+    
+    if redis is not None:
+        cached = await redis.get(cache_key)
+        cached = json.loads(cached) if cached else None
+    else:
+        expires_at, cached = _created_bots.get(cache_key, (0, None))
+        if expires_at <= time.time():
+            cached = None
+    if cached and (auto or cached['username'] == username):
+        return {'success': True, 'reused': True, **cached}
+    
+    result = await create_bot(bot_name, username)
+    
+    if result.get('token'):
+        entry = {'token': result['token'], 'username': result['username']}
+        if redis is not None:
+            await redis.setex(cache_key, CREATE_CACHE_TTL, json.dumps(entry))
+        else:
+            now = time.time()
+            for key in [key for key, (expires_at, _) in _created_bots.items() if expires_at <= now]:
+                del _created_bots[key]
+            _created_bots[cache_key] = (now + CREATE_CACHE_TTL, entry)
+    
+    return result
+
+
+@contextlib.asynccontextmanager
+async def _create_slot(message: Message):
+    """Hold one of MAX_CONCURRENT_CREATES slots, telling the user when they have to wait"""
+    global _create_queue
+    
+    if _create_semaphore.locked():
+        await message.answer(f"Queued, position ~{_create_queue + 1}. Creation starts as soon as a slot is free.")
+    
+    _create_queue += 1
+    try:
+        await _create_semaphore.acquire()
+    finally:
+        _create_queue -= 1
+    
+    try:
+        yield
+    finally:
+        _create_semaphore.release()
+
 
 class BotCreationStates(StatesGroup):
     waiting_for_bot_name = State()
@@ -55,38 +228,13 @@ class BotCreationStates(StatesGroup):
 @dp.message(CommandStart())
 async def start_handler(message: Message):
     """Handle /start command"""
-    status = "Ready" if TELETHON_AVAILABLE and os.getenv('TELEGRAM_API_ID') and os.getenv('TELEGRAM_API_HASH') else "Not configured"
-    
-    await message.answer(
-        f"Bot Creator SDK\n\n"
-        f"Status: {status}\n\n"
-        f"Commands:\n"
-        f"/create - Create a new bot\n"
-        f"/help - Show help"
-    )
+    await message.answer(_START_TEXT)
 
 
 @dp.message(Command('help'))
 async def help_handler(message: Message):
     """Handle /help command"""
-    setup_info = ""
-    if not TELETHON_AVAILABLE:
-        setup_info = "\n\nSetup: pip install telethon"
-    elif not os.getenv('TELEGRAM_API_ID') or not os.getenv('TELEGRAM_API_HASH'):
-        setup_info = "\n\nConfiguration required:\n1. Get API_ID and API_HASH from https://my.telegram.org/apps\n2. Add them to .env file\n3. Run: python setup_telethon.py"
-    
-    await message.answer(
-        f"Bot Creator SDK Help\n\n"
-        f"Usage:\n"
-        f"1. Use /create command\n"
-        f"2. Enter bot name\n"
-        f"3. Enter bot username (or /auto to generate)\n"
-        f"4. Send avatar photo (optional, use /skip to skip)\n\n"
-        f"The bot will:\n"
-        f"- Create bot via BotFather\n"
-        f"- Set description\n"
-        f"- Return token{setup_info}"
-    )
+    await message.answer(_HELP_TEXT)
 
 
 @dp.message(Command('create'))
@@ -116,10 +264,10 @@ async def process_username(message: Message, state: FSMContext):
     data = await state.get_data()
     bot_name = data.get('bot_name')
     
-    if message.text.strip().lower() == '/auto':
+    auto = message.text.strip().lower() == '/auto'
+    if auto:
         # Generate username automatically
-        random_suffix = ''.join(secrets.choice(string.ascii_lowercase + string.digits) for _ in range(8))
-        username = f"{USERNAME_PREFIX}{random_suffix}bot"
+        username = f"{USERNAME_PREFIX}{_rand_suffix()}bot"
     else:
         username = message.text.strip().lower()
         
@@ -128,7 +276,7 @@ async def process_username(message: Message, state: FSMContext):
             await message.answer("Username must end with 'bot'. Try again:")
             return
         
-        if not re.match(r'^[a-z0-9_]+$', username):
+        if not _USERNAME_RE.match(username):
             await message.answer("Username can only contain lowercase letters, numbers, and underscores. Try again:")
             return
         
@@ -137,60 +285,50 @@ async def process_username(message: Message, state: FSMContext):
             return
     
     await message.answer(f"Creating bot: {bot_name}\nUsername: @{username}")
+    logger.info("stage=create user_id=%s bot_username=%s", message.from_user.id, username)
     
-    result = await create_bot(bot_name, username, delay=MESSAGE_DELAY)
-    
-    if result.get('token'):
-        bot_username = result.get('username', username).replace('@', '')
-        description_set = await set_bot_description(result['token'], bot_username, delay=MESSAGE_DELAY)
+    async with _create_slot(message):
+        result = await _create_bot_cached(message.from_user.id, bot_name, username, auto)
         
-        await state.update_data(
-            bot_token=result['token'],
-            bot_username=bot_username,
-            bot_name=bot_name
-        )
-        
-        await message.answer(
-            f"Bot created successfully\n\n"
-            f"Name: {bot_name}\n"
-            f"Username: @{bot_username}\n"
-            f"Token: `{result['token']}`\n\n"
-            f"Description: {'Set' if description_set else 'Not set'}\n\n"
-            f"Send photo for bot avatar (or /skip to skip):",
-            parse_mode='Markdown'
-        )
-        await state.set_state(BotCreationStates.waiting_for_avatar)
-    else:
-        error_msg = result.get('error', 'Unknown error')
-        if "already" in error_msg.lower() or "taken" in error_msg.lower():
+        if not result.get('token') and _TAKEN_RE.search(result.get('error', '')):
             # Retry with new username
-            random_suffix = ''.join(secrets.choice(string.ascii_lowercase + string.digits) for _ in range(10))
-            username = f"{USERNAME_PREFIX}{random_suffix}bot"
-            result = await create_bot(bot_name, username)
+            username = f"{USERNAME_PREFIX}{_rand_suffix(10)}bot"
+            result = await _create_bot_cached(message.from_user.id, bot_name, username, auto=False)
+        
+        if result.get('token'):
+            bot_username = result.get('username', username).replace('@', '')
+            description_set = await set_bot_description(result['token'], bot_username)
+            logger.info(
+                "stage=created user_id=%s bot_username=%s description_set=%s",
+                message.from_user.id, bot_username, description_set
+            )
+            
+            await state.update_data(
+                bot_token=result['token'],
+                bot_username=bot_username,
+                bot_name=bot_name
+            )
             
-            if result.get('token'):
-                bot_username = result.get('username', username).replace('@', '')
-                description_set = await set_bot_description(result['token'], bot_username, delay=MESSAGE_DELAY)
-                await state.update_data(
-                    bot_token=result['token'],
-                    bot_username=bot_username,
-                    bot_name=bot_name
-                )
-                await message.answer(
-                    f"Bot created successfully\n\n"
-                    f"Name: {bot_name}\n"
-                    f"Username: @{bot_username}\n"
-                    f"Token: `{result['token']}`\n\n"
-                    f"Description: {'Set' if description_set else 'Not set'}\n\n"
-                    f"Send photo for bot avatar (or /skip to skip):",
-                    parse_mode='Markdown'
-                )
-                await state.set_state(BotCreationStates.waiting_for_avatar)
+            if result.get('reused'):
+                heading = "You created a bot with this name a few minutes ago, reusing it"
             else:
-                await message.answer(f"Error: {result.get('error', 'Unknown error')}")
-                await state.clear()
+                heading = "Bot created successfully"
+            await message.answer(
+                f"{heading}\n\n"
+                f"Name: {bot_name}\n"
+                f"Username: @{bot_username}\n"
+                f"Token: `{result['token']}`\n\n"
+                f"Description: {'Set' if description_set else 'Not set'}\n\n"
+                f"Send photo for bot avatar (or /skip to skip):",
+                parse_mode='Markdown'
+            )
+            await state.set_state(BotCreationStates.waiting_for_avatar)
         else:
-            await message.answer(f"Error: {error_msg}")
+            logger.warning(
+                "stage=create_failed user_id=%s bot_username=%s error=%s",
+                message.from_user.id, username, result.get('error')
+            )
+            await message.answer(f"Error: {result.get('error', 'Unknown error')}")
             await state.clear()
 
 
@@ -208,19 +346,15 @@ async def process_avatar(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        photo = message.photo[-1]
-        file_info = await bot.get_file(photo.file_id)
-        
-        os.makedirs('temp', exist_ok=True)
-        temp_file = f"temp/avatar_{message.from_user.id}_{photo.file_id}.jpg"
-        await bot.download_file(file_info.file_path, temp_file)
-        
-        avatar_set = await set_bot_avatar(bot_username, temp_file, delay=MESSAGE_DELAY)
+        avatar = io.BytesIO()
+        avatar.name = 'avatar.jpg'  # Lets Telethon detect the upload as a photo
+        await message.bot.download(message.photo[-1], destination=avatar)
         
-        try:
-            os.remove(temp_file)
-        except:
-            pass
+        avatar_set = await set_bot_avatar(bot_username, avatar)
+        logger.info(
+            "stage=avatar user_id=%s bot_username=%s avatar_set=%s",
+            message.from_user.id, bot_username, avatar_set
+        )
         
         if avatar_set:
             await message.answer(
@@ -240,7 +374,7 @@ async def process_avatar(message: Message, state: FSMContext):
         
         await state.clear()
     except Exception as e:
-        logger.error(f"Avatar processing error: {e}", exc_info=True)
+        logger.error("stage=avatar user_id=%s error=%s", message.from_user.id, e, exc_info=True)
         await message.answer(f"Error processing avatar: {str(e)}")
         await state.clear()
 
@@ -270,299 +404,314 @@ async def skip_avatar(message: Message, state: FSMContext):
     await state.clear()
 
 
-async def create_bot(bot_name: str, username: str, delay: float = None) -> Dict:
+class SessionNotAuthorizedError(RuntimeError):
+    """The Telethon session file is missing or not logged in"""
+
+
+class TelethonSession:
+    """
+    Shared Telethon client reused across BotFather conversations
+    
+    The client connects on first use and stays connected, so one /create flow
+    (newbot, setdescription, setuserpic) performs a single MTProto handshake.
+    Each `async with` block holds the lock for its whole duration, so only one
+    coroutine at a time drives the client and writes to its SQLite .session file.
+    """
+    
+    def __init__(self, session_name: str):
+        self.session_name = session_name
+        self.client = None
+        self.botfather = None
+        self._lock = asyncio.Lock()
+    
+    async def __aenter__(self) -> 'TelethonSession':
+        await self._lock.acquire()
+        try:
+            if self.client is None or not self.client.is_connected():
+                await self._connect()
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._lock.release()
+    
+    async def _connect(self) -> None:
+        """Connect and verify the session is authorized"""
+        if self.client is None:
+            # Checked once per client; TelegramClient would otherwise create an empty session
+            if not await asyncio.to_thread(os.path.exists, f'{self.session_name}.session'):
+                raise SessionNotAuthorizedError('Session not authorized. Run setup_telethon.py')
+            
+            self.client = TelegramClient(
+                self.session_name,
+                API_ID,
+                API_HASH,
+                flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD
+            )
+        
+        await self.client.connect()
+        me = await self.client.get_me()
+        if me is None:
+            await self.client.disconnect()
+            raise SessionNotAuthorizedError('Session not authorized. Run setup_telethon.py')
+        logger.info("stage=connect authorized_as=%s", me.first_name)
+        
+        if self.botfather is None:
+            self.botfather = await self.client.get_input_entity('BotFather')
+    
+    async def close(self) -> None:
+        """Disconnect the shared client"""
+        async with self._lock:
+            if self.client is not None:
+                await self.client.disconnect()
+                self.client = None
+
+
+telethon_session = TelethonSession(SESSION_NAME)
+
+
+async def _botfather_call(func, *args, **kwargs):
+    """Run a Telethon send to BotFather under the shared rate limit"""
+    async with _botfather_limiter:
+        return await func(*args, **kwargs)
+
+
+async def _botfather_select_bot(session: TelethonSession, conv, command: str, bot_username: str) -> bool:
+    """
+    Send a BotFather command that asks for a bot and choose bot_username
+    
+    Clicks the matching inline button when there is one, otherwise types
+    @username, which BotFather also accepts for its reply keyboards. Typing is
+    also the fallback when Telegram rejects the click, but not once the click
+    has reached BotFather.
+    
+    Returns:
+        True once BotFather has acknowledged the selection, False otherwise
+    """
+    clean_username = bot_username.replace('@', '').lower()
+    stage = command.lstrip('/')
+    
+    await _botfather_call(conv.send_message, command)
+    msg = await conv.get_response()
+    
+    button = None
+    if msg.reply_markup and hasattr(msg.reply_markup, 'rows'):
+        button = next(
+            (b for row in msg.reply_markup.rows for b in row.buttons
+             if clean_username in getattr(b, 'text', '').lower()),
+            None
+        )
+    
+    if button is not None and hasattr(button, 'data'):
+        # BotFather may either edit the keyboard message or send a new one, so wait for
+        # both; the builders are resolved up front so the waits register before the click
+        acks = [
+            events.MessageEdited(chats=session.botfather, incoming=True),
+            events.NewMessage(chats=session.botfather, incoming=True),
+        ]
+        for ack in acks:
+            await ack.resolve(session.client)
+        waits = [asyncio.ensure_future(conv.wait_event(ack)) for ack in acks]
+        
+        try:
+            delivered = True
+            try:
+                await _botfather_call(session.client, GetBotCallbackAnswerRequest(
+                    peer=session.botfather,
+                    msg_id=msg.id,
+                    data=button.data
+                ))
+            except BotResponseTimeoutError:
+                # The click reached BotFather, it just answered the callback query late
+                logger.info("stage=%s bot_username=%s button click answer timed out", stage, clean_username)
+            except FloodWaitError:
+                raise
+            except RPCError as e:
+                # Telegram rejected the click, so BotFather has not selected the bot
+                logger.warning("stage=%s bot_username=%s button click error: %s", stage, clean_username, e)
+                delivered = False
+            
+            if delivered:
+                # The bot is selected now, so typing @username would be taken as the new value
+                pending = set(waits)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if any(not task.cancelled() and task.exception() is None for task in done):
+                        return True
+                logger.warning("stage=%s bot_username=%s no reply after button click", stage, clean_username)
+                return False
+        finally:
+            for task in waits:
+                task.cancel()
+    
+    await _botfather_call(conv.send_message, f"@{clean_username}")
+    await conv.get_response()
+    return True
+
+
+def _warn_delay_deprecated(delay: Optional[float]) -> None:
+    """Warn SDK callers still passing the old fixed delay between BotFather messages"""
+    if delay is not None:
+        warnings.warn(
+            "'delay' is deprecated and ignored, BotFather replies are awaited; use 'timeout' instead",
+            DeprecationWarning,
+            stacklevel=3
+        )
+
+
+async def create_bot(bot_name: str, username: str, timeout: float = None, delay: float = None) -> Dict:
     """
     Create bot via BotFather using Telethon
     
     Args:
         bot_name: Name of the bot
         username: Username for the bot (must end with 'bot')
-        delay: Delay between messages in seconds (default: MESSAGE_DELAY from env)
+        timeout: Max seconds to wait for each BotFather reply (default: RESPONSE_TIMEOUT from env)
+        delay: Deprecated and ignored, replies are awaited instead of sleeping between messages
     
     Returns:
         Dict with success, token, username, error keys
     """
-    if delay is None:
-        delay = MESSAGE_DELAY
+    _warn_delay_deprecated(delay)
+    if timeout is None:
+        timeout = RESPONSE_TIMEOUT
     
     if not TELETHON_AVAILABLE:
         return {'success': False, 'error': 'Telethon not installed', 'token': None}
     
+    if not TELETHON_CONFIGURED:
+        return {'success': False, 'error': 'TELEGRAM_API_ID and TELEGRAM_API_HASH not found', 'token': None}
+    
     try:
-        api_id = os.getenv('TELEGRAM_API_ID')
-        api_hash = os.getenv('TELEGRAM_API_HASH')
-        
-        if not api_id or not api_hash:
-            return {'success': False, 'error': 'TELEGRAM_API_ID and TELEGRAM_API_HASH not found', 'token': None}
-        
-        session_name = 'sessions/bot_creator'
-        os.makedirs('sessions', exist_ok=True)
-        
-        if not os.path.exists(f'{session_name}.session'):
-            return {'success': False, 'error': 'Session not authorized. Run setup_telethon.py', 'token': None}
-        
-        client = TelegramClient(session_name, int(api_id), api_hash)
-        
-        try:
-            await client.start()
-            me = await client.get_me()
-            logger.info(f"Authorized as: {me.first_name}")
-            
-            botfather_username = 'BotFather'
-            
-            await client.send_message(botfather_username, '/newbot')
-            await asyncio.sleep(delay)
-            
-            await client.send_message(botfather_username, bot_name)
-            await asyncio.sleep(delay)
+        async with telethon_session as session:
+            client = session.client
             
-            await client.send_message(botfather_username, username)
-            await asyncio.sleep(delay * 1.3)  # Slightly longer for token response
+            async with client.conversation(session.botfather, timeout=timeout) as conv:
+                # Stop at the first refusal (e.g. too many attempts) instead of sending the
+                # remaining answers, which BotFather would no longer read as part of /newbot
+                for answer in ('/newbot', bot_name, username):
+                    await _botfather_call(conv.send_message, answer)
+                    reply = await conv.get_response()
+                    if _CREATE_ERROR_RE.search(reply.text or ""):
+                        break
             
-            messages = await client.get_messages(botfather_username, limit=5)
+            text = reply.text or ""
+            error_found = _CREATE_ERROR_RE.search(text) is not None
             
+            # BotFather sends the token as a monospace entity; scan the text only as a fallback
             token = None
-            error_found = False
-            last_message_text = ""
+            for _, code in reply.get_entities_text(MessageEntityCode):
+                if _TOKEN_RE.fullmatch(code):
+                    token = code
+                    break
             
-            for msg in messages:
-                if msg.text:
-                    last_message_text = msg.text
-                    
-                    error_indicators = ["Sorry", "error", "already", "taken", "invalid", "not available"]
-                    if any(indicator.lower() in msg.text.lower() for indicator in error_indicators):
-                        error_found = True
-                    
-                    token_patterns = [
-                        r'(\d+:[A-Za-z0-9_-]{20,})',
-                        r'Use this token.*?(\d+:[A-Za-z0-9_-]+)',
-                        r'Токен.*?(\d+:[A-Za-z0-9_-]+)',
-                    ]
-                    
-                    for pattern in token_patterns:
-                        match = re.search(pattern, msg.text, re.IGNORECASE)
-                        if match:
-                            token = match.group(1)
-                            break
-                    
-                    if token:
-                        break
+            if token is None:
+                match = _TOKEN_RE.search(text)
+                token = match.group(1) if match else None
             
             if token:
                 return {'success': True, 'token': token, 'username': username}
             else:
-                error_msg = last_message_text[:500] if error_found and last_message_text else "Token not found in BotFather response"
+                error_msg = text[:500] if error_found and text else "Token not found in BotFather response"
                 return {'success': False, 'error': error_msg, 'token': None}
-                
-        finally:
-            await client.disconnect()
             
-    except SessionPasswordNeededError:
-        return {'success': False, 'error': '2FA required. Run setup_telethon.py', 'token': None}
+    except SessionNotAuthorizedError as e:
+        logger.warning("stage=newbot bot_username=%s error=%s", username, e)
+        return {'success': False, 'error': str(e), 'token': None}
+    except asyncio.TimeoutError:
+        return {'success': False, 'error': 'BotFather did not respond in time', 'token': None}
+    except FloodWaitError as e:
+        logger.warning("stage=newbot bot_username=%s flood_wait=%ss", username, e.seconds)
+        return {'success': False, 'error': f'Too many requests to BotFather. Try again in {e.seconds} seconds', 'token': None}
     except Exception as e:
-        logger.error(f"Bot creation error: {e}", exc_info=True)
+        logger.error("stage=newbot bot_username=%s error=%s", username, e, exc_info=True)
         return {'success': False, 'error': str(e), 'token': None}
 
 
-async def set_bot_description(token: str, bot_username: str, delay: float = None) -> bool:
+async def set_bot_description(token: str, bot_username: str, timeout: float = None, delay: float = None) -> bool:
     """
     Set bot description via BotFather
     
     Args:
         token: Bot token
         bot_username: Bot username (without @)
-        delay: Delay between messages in seconds (default: MESSAGE_DELAY from env)
+        timeout: Max seconds to wait for each BotFather reply (default: RESPONSE_TIMEOUT from env)
+        delay: Deprecated and ignored, replies are awaited instead of sleeping between messages
     
     Returns:
         True if successful, False otherwise
     """
-    if delay is None:
-        delay = MESSAGE_DELAY
+    _warn_delay_deprecated(delay)
+    if timeout is None:
+        timeout = RESPONSE_TIMEOUT
     
-    if not TELETHON_AVAILABLE:
+    if not TELETHON_AVAILABLE or not TELETHON_CONFIGURED:
         return False
     
     try:
-        api_id = os.getenv('TELEGRAM_API_ID')
-        api_hash = os.getenv('TELEGRAM_API_HASH')
-        
-        if not api_id or not api_hash:
-            return False
-        
-        session_name = 'sessions/bot_creator'
-        client = TelegramClient(session_name, int(api_id), api_hash)
-        
-        try:
-            await client.start()
-            botfather_username = 'BotFather'
-            clean_username = bot_username.replace('@', '')
-            
-            await client.send_message(botfather_username, '/setdescription')
-            await asyncio.sleep(delay)
-            
-            messages = await client.get_messages(botfather_username, limit=1)
-            
-            if messages and messages[0].reply_markup:
-                msg = messages[0]
-                bot_found = False
-                
-                try:
-                    for row in msg.reply_markup.rows:
-                        for button in row.buttons:
-                            button_text = button.text if hasattr(button, 'text') else str(button)
-                            if clean_username.lower() in button_text.lower():
-                                botfather_entity = await client.get_entity(botfather_username)
-                                await client(GetBotCallbackAnswerRequest(
-                                    peer=botfather_entity,
-                                    msg_id=msg.id,
-                                    data=button.data
-                                ))
-                                bot_found = True
-                                await asyncio.sleep(delay)
-                                break
-                        if bot_found:
-                            break
-                    
-                    if not bot_found:
-                        first_row = msg.reply_markup.rows[0]
-                        first_button = first_row.buttons[0]
-                        botfather_entity = await client.get_entity(botfather_username)
-                        await client(GetBotCallbackAnswerRequest(
-                            peer=botfather_entity,
-                            msg_id=msg.id,
-                            data=first_button.data
-                        ))
-                        await asyncio.sleep(delay)
-                except Exception as e:
-                    logger.warning(f"Button click error: {e}")
-                    await client.send_message(botfather_username, f"@{clean_username}")
-                    await asyncio.sleep(delay)
-            else:
-                await client.send_message(botfather_username, f"@{clean_username}")
-                await asyncio.sleep(delay)
+        async with telethon_session as session:
+            async with session.client.conversation(session.botfather, timeout=timeout) as conv:
+                if not await _botfather_select_bot(session, conv, '/setdescription', bot_username):
+                    return False
+                await _botfather_call(conv.send_message, BOT_DESCRIPTION)
+                reply = await conv.get_response()
             
-            await client.send_message(botfather_username, BOT_DESCRIPTION)
-            await asyncio.sleep(delay)
-            
-            messages = await client.get_messages(botfather_username, limit=3)
-            
-            for msg in messages:
-                if msg.text:
-                    success_indicators = ["successfully", "успешно", "Success", "description"]
-                    if any(indicator.lower() in msg.text.lower() for indicator in success_indicators):
-                        return True
-                    error_indicators = ["error", "ошибка", "Sorry", "invalid"]
-                    if any(indicator.lower() in msg.text.lower() for indicator in error_indicators):
-                        return False
-            
-            return False
-            
-        finally:
-            await client.disconnect()
+            return bool(reply.text and _DESCRIPTION_SUCCESS_RE.search(reply.text))
             
+    except SessionNotAuthorizedError as e:
+        logger.warning("stage=setdescription bot_username=%s error=%s", bot_username, e)
+        return False
+    except FloodWaitError as e:
+        logger.warning("stage=setdescription bot_username=%s flood_wait=%ss", bot_username, e.seconds)
+        return False
     except Exception as e:
-        logger.error(f"Description setting error: {e}", exc_info=True)
+        logger.error("stage=setdescription bot_username=%s error=%s", bot_username, e, exc_info=True)
         return False
 
 
-async def set_bot_avatar(bot_username: str, photo_path: str, delay: float = None) -> bool:
+async def set_bot_avatar(bot_username: str, photo_path: Union[str, bytes, BinaryIO], timeout: float = None, delay: float = None) -> bool:
     """
     Set bot avatar via BotFather
     
     Args:
         bot_username: Bot username (without @)
-        photo_path: Path to photo file
-        delay: Delay between messages in seconds (default: MESSAGE_DELAY from env)
+        photo_path: Path to photo file, raw bytes or file-like object
+        timeout: Max seconds to wait for each BotFather reply (default: RESPONSE_TIMEOUT from env)
+        delay: Deprecated and ignored, replies are awaited instead of sleeping between messages
     
     Returns:
         True if successful, False otherwise
     """
-    if delay is None:
-        delay = MESSAGE_DELAY
+    _warn_delay_deprecated(delay)
+    if timeout is None:
+        timeout = RESPONSE_TIMEOUT
     
-    if not TELETHON_AVAILABLE:
+    if not TELETHON_AVAILABLE or not TELETHON_CONFIGURED:
         return False
     
     try:
-        api_id = os.getenv('TELEGRAM_API_ID')
-        api_hash = os.getenv('TELEGRAM_API_HASH')
-        
-        if not api_id or not api_hash or not os.path.exists(photo_path):
+        if isinstance(photo_path, str) and not await asyncio.to_thread(os.path.exists, photo_path):
             return False
         
-        session_name = 'sessions/bot_creator'
-        client = TelegramClient(session_name, int(api_id), api_hash)
-        
-        try:
-            await client.start()
-            botfather_username = 'BotFather'
-            clean_username = bot_username.replace('@', '')
-            
-            await client.send_message(botfather_username, '/setuserpic')
-            await asyncio.sleep(delay)
-            
-            messages = await client.get_messages(botfather_username, limit=1)
+        async with telethon_session as session:
+            async with session.client.conversation(session.botfather, timeout=timeout) as conv:
+                if not await _botfather_select_bot(session, conv, '/setuserpic', bot_username):
+                    return False
+                await _botfather_call(conv.send_file, photo_path)
+                reply = await conv.get_response()
             
-            if messages and messages[0].reply_markup:
-                msg = messages[0]
-                bot_found = False
-                
-                try:
-                    for row in msg.reply_markup.rows:
-                        for button in row.buttons:
-                            button_text = button.text if hasattr(button, 'text') else str(button)
-                            if clean_username.lower() in button_text.lower():
-                                botfather_entity = await client.get_entity(botfather_username)
-                                await client(GetBotCallbackAnswerRequest(
-                                    peer=botfather_entity,
-                                    msg_id=msg.id,
-                                    data=button.data
-                                ))
-                                bot_found = True
-                                await asyncio.sleep(delay)
-                                break
-                        if bot_found:
-                            break
-                    
-                    if not bot_found:
-                        first_row = msg.reply_markup.rows[0]
-                        first_button = first_row.buttons[0]
-                        botfather_entity = await client.get_entity(botfather_username)
-                        await client(GetBotCallbackAnswerRequest(
-                            peer=botfather_entity,
-                            msg_id=msg.id,
-                            data=first_button.data
-                        ))
-                        await asyncio.sleep(delay)
-                except Exception as e:
-                    logger.warning(f"Button click error: {e}")
-                    await client.send_message(botfather_username, f"@{clean_username}")
-                    await asyncio.sleep(delay)
-            else:
-                await client.send_message(botfather_username, f"@{clean_username}")
-                await asyncio.sleep(delay)
-            
-            await client.send_file(botfather_username, photo_path)
-            await asyncio.sleep(delay * 1.3)  # Slightly longer for photo processing
-            
-            messages = await client.get_messages(botfather_username, limit=3)
-            
-            for msg in messages:
-                if msg.text:
-                    success_indicators = ["successfully", "успешно", "Success", "picture"]
-                    if any(indicator.lower() in msg.text.lower() for indicator in success_indicators):
-                        return True
-                    error_indicators = ["error", "ошибка", "Sorry", "invalid"]
-                    if any(indicator.lower() in msg.text.lower() for indicator in error_indicators):
-                        return False
-            
-            return False
-            
-        finally:
-            await client.disconnect()
+            return bool(reply.text and _AVATAR_SUCCESS_RE.search(reply.text))
             
+    except SessionNotAuthorizedError as e:
+        logger.warning("stage=setuserpic bot_username=%s error=%s", bot_username, e)
+        return False
+    except FloodWaitError as e:
+        logger.warning("stage=setuserpic bot_username=%s flood_wait=%ss", bot_username, e.seconds)
+        return False
     except Exception as e:
-        logger.error(f"Avatar setting error: {e}", exc_info=True)
+        logger.error("stage=setuserpic bot_username=%s error=%s", bot_username, e, exc_info=True)
         return False
 
 
@@ -574,9 +723,19 @@ async def unknown_handler(message: Message):
 
 async def main():
     """Main function"""
+    if not BOT_TOKEN:
+        logger.critical("BOT_TOKEN not found in environment variables")
+        sys.exit(1)
+    
+    bot = Bot(token=BOT_TOKEN, session=KeepAliveAiohttpSession())
+    bot.session.middleware(BotApiRateLimitMiddleware())
+    
     logger.info("Starting bot...")
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    try:
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await telethon_session.close()
 
 
 if __name__ == '__main__':
@@ -585,4 +744,4 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("Bot stopped")
     except Exception as e:
-        logger.error(f"Critical error: {e}")
+        logger.error("Critical error: %s", e)